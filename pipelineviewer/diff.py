@@ -0,0 +1,287 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Alignment of two instruction streams with Myers' O(ND) difference algorithm
+# in its linear-space (middle snake) formulation, so that traces with millions
+# of instructions can be compared as long as they mostly agree. Like GNU diff,
+# the search for a middle snake gives up after max_cost edits and splits at the
+# furthest point reached instead, which bounds the cost on diverging traces at
+# the price of a possibly non-minimal result.
+
+MAX_COST = 64
+
+
+def trace_records(pipeline):
+    # Only what the diff needs, as plain tuples that are cheap to pickle:
+    # (pc, insn, mode, timestamp of each stage..., end)
+    # (subscripts, the AttrDict attribute and get() lookups are much slower)
+    fields = pipeline.get_stages() + ["end"]
+    return [(i["pc"], i["insn"], i["mode"]) + tuple(i[f] if f in i else None for f in fields)
+            for i in pipeline.log.values()]
+
+
+def trace_keys(records, table):
+    # Intern (pc, insn) to small integers so the diff compares ints only
+    return [table.setdefault(r[:2], len(table)) for r in records]
+
+
+def align(a, b, max_cost=MAX_COST):
+    opcodes = _diff(a, b, max_cost)
+
+    merged = []
+    for op in opcodes:
+        if op[1] == op[2] and op[3] == op[4]:
+            continue
+        if merged and merged[-1][0] == op[0]:
+            last = merged[-1]
+            merged[-1] = (op[0], last[1], op[2], last[3], op[4])
+        elif merged and {merged[-1][0], op[0]} == {"delete", "insert"}:
+            last = merged[-1]
+            merged[-1] = ("replace", last[1], op[2], last[3], op[4])
+        elif merged and merged[-1][0] == "replace" and op[0] in ("delete", "insert"):
+            last = merged[-1]
+            merged[-1] = ("replace", last[1], op[2], last[3], op[4])
+        else:
+            merged.append(op)
+    return merged
+
+
+def _diff(a, b, max_cost):
+    # Iterative, as the splits of a long diverging trace nest deeply
+    out = []
+    todo = [(0, len(a), 0, len(b))]
+    while todo:
+        task = todo.pop()
+        if isinstance(task[0], str):
+            out.append(task)
+            continue
+        alo, ahi, blo, bhi = task
+
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        out.append(("equal", start, alo, blo - (alo - start), blo))
+
+        suffix = 0
+        while alo < ahi - suffix and blo < bhi - suffix and a[ahi - suffix - 1] == b[bhi - suffix - 1]:
+            suffix += 1
+        ahi -= suffix
+        bhi -= suffix
+        todo.append(("equal", ahi, ahi + suffix, bhi, bhi + suffix))
+
+        if alo == ahi:
+            out.append(("insert", alo, alo, blo, bhi))
+        elif blo == bhi:
+            out.append(("delete", alo, ahi, blo, blo))
+        else:
+            split = _middle_snake(a, b, alo, ahi, blo, bhi, max_cost)
+            if split is None:
+                out.append(("delete", alo, ahi, blo, blo))
+                out.append(("insert", ahi, ahi, blo, bhi))
+            else:
+                x, y = split
+                todo.append((x, ahi, y, bhi))
+                todo.append((alo, x, blo, y))
+    return out
+
+
+def _middle_snake(a, b, alo, ahi, blo, bhi, max_cost):
+    n = ahi - alo
+    m = bhi - blo
+    max_d = (n + m + 1) // 2
+    cost = min(max_d, max_cost)
+    offset = cost
+    length = 2 * cost + 2
+    v1 = [-1] * length
+    v2 = [-1] * length
+    v1[offset + 1] = 0
+    v2[offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+
+    for d in range(cost):
+        # Walk the forward path
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[alo + x1] == b[blo + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return alo + x1, blo + y1
+
+        # Walk the reverse path
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[ahi - x2 - 1] == b[bhi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return alo + x1, blo + y1
+
+    if max_d <= max_cost:
+        return None
+
+    # Too expensive: split where either path got furthest
+    best, split = 0, None
+    for k_offset in range(length):
+        x1 = v1[k_offset]
+        y1 = x1 - (k_offset - offset)
+        if 0 <= x1 <= n and 0 <= y1 <= m and x1 + y1 > best:
+            best, split = x1 + y1, (x1, y1)
+        x2 = v2[k_offset]
+        y2 = x2 - (k_offset - offset)
+        if 0 <= x2 <= n and 0 <= y2 <= m and x2 + y2 > best:
+            best, split = x2 + y2, (n - x2, m - y2)
+    if split is None or split in ((0, 0), (n, m)):
+        return None
+    return alo + split[0], blo + split[1]
+
+
+def stage_latencies(r):
+    # Cycles spent in each stage, measured like the waterfall draws them
+    ts = r[3:]
+    lat = []
+    for s in range(len(ts) - 1):
+        if ts[s] is None or ts[s + 1] is None:
+            lat.append(None)
+        else:
+            lat.append(ts[s + 1] - ts[s])
+    total = None
+    if ts[0] is not None:
+        last = ts[-1]
+        if last is None:
+            last = ts[-2]
+        if last is not None:
+            total = last - ts[0]
+    lat.append(total)
+    return lat
+
+
+def latency_delta(a, b):
+    return [None if x is None or y is None else y - x for x, y in zip(a, b)]
+
+
+class PCStats(object):
+    def __init__(self, nlat):
+        self.count = 0
+        self.changed = 0
+        self.sum = [0] * nlat
+        self.samples = [0] * nlat
+
+    def add(self, delta):
+        self.count += 1
+        if any(delta):
+            self.changed += 1
+        for s in range(len(delta)):
+            if delta[s] is not None:
+                self.sum[s] += delta[s]
+                self.samples[s] += 1
+
+    def mean(self, s):
+        return self.sum[s] / self.samples[s] if self.samples[s] else None
+
+
+class TraceDiff(object):
+    def __init__(self, a, b, stages):
+        self.a = a
+        self.b = b
+        self.stages = stages
+
+        table = {}
+        self.opcodes = align(trace_keys(a, table), trace_keys(b, table))
+
+        self.per_pc = {}
+        self.changed = []  # aligned (a0, a1, b0, b1) ranges that differ
+        self.deltas = {}   # a index -> (b index, per stage latency delta)
+        for tag, a0, a1, b0, b1 in self.opcodes:
+            if tag != "equal":
+                self.changed.append((a0, a1, b0, b1))
+                continue
+            run = None
+            for x in range(a1 - a0):
+                pc = a[a0 + x][0]
+                delta = latency_delta(stage_latencies(a[a0 + x]),
+                                      stage_latencies(b[b0 + x]))
+                if pc not in self.per_pc:
+                    self.per_pc[pc] = PCStats(len(delta))
+                self.per_pc[pc].add(delta)
+                if any(d for d in delta):
+                    self.deltas[a0 + x] = (b0 + x, delta)
+                    if run is None:
+                        run = x
+                elif run is not None:
+                    self.changed.append((a0 + run, a0 + x, b0 + run, b0 + x))
+                    run = None
+            if run is not None:
+                self.changed.append((a0 + run, a1, b0 + run, b1))
+
+    def hunks(self, context, modes=None):
+        hunks = []
+        for a0, a1, b0, b1 in self.changed:
+            if modes is not None and not any(r[2] in modes for r in self.a[a0:a1] + self.b[b0:b1]):
+                continue
+            a0 = max(0, a0 - context)
+            b0 = max(0, b0 - context)
+            a1 = min(len(self.a), a1 + context)
+            b1 = min(len(self.b), b1 + context)
+            if hunks and a0 <= hunks[-1][1]:
+                hunks[-1] = (hunks[-1][0], a1, hunks[-1][2], b1)
+            else:
+                hunks.append((a0, a1, b0, b1))
+        return hunks
+
+    def top_pcs(self, count):
+        pcs = [p for p in self.per_pc.items() if p[1].changed]
+        pcs.sort(key=lambda p: abs(p[1].mean(-1) or 0), reverse=True)
+        return pcs[:count]
+
+
+def parse_trace(cls, path):
+    # Runs in a worker process, so only plain data is sent back
+    if path == "-":
+        pipeline = cls(sys.stdin)
+    elif os.path.isdir(path):
+        pipeline = cls(path)
+    else:
+        with open(path) as f:
+            pipeline = cls(f)
+    return trace_records(pipeline), pipeline.get_stages()
+
+
+def parse_concurrently(cls, trace_a, trace_b):
+    traces = (trace_a, trace_b)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        # stdin stays with this process, it is parsed here meanwhile
+        jobs = [None if t == "-" else executor.submit(parse_trace, cls, t) for t in traces]
+        return [parse_trace(cls, t) if j is None else j.result() for t, j in zip(traces, jobs)]
@@ -19,6 +19,7 @@ import itertools
 from .ibex import PipelineIbex
 from .boom import PipelineBOOM
 from .swerv import PipelineSwervEL2
+from .diff import TraceDiff, parse_concurrently
 
 from .version import version
 
@@ -38,6 +39,8 @@ display = {"IF": AttrDict(char="f", fore=colorama.Fore.WHITE, back=colorama.Back
 
 pipelines = {"ibex": PipelineIbex, "boom": PipelineBOOM, "swerv-el2": PipelineSwervEL2}
 
+col_width = {'m': 1, 'r': 8, 't': 17, 'p': 16 }
+
 def render(pipeline, args):
     if args.colored:
         colorama.init(strip=False)
@@ -48,6 +51,12 @@ def render(pipeline, args):
 
     stages = pipeline.get_stages()
 
+    render_header(stages, args)
+    render_instructions(pipeline.log.values(), stages, args, model)
+    colorama.deinit()
+
+
+def render_header(stages, args):
     header_legend = []
     length = 0  # need to keep track separately
     for s in stages:
@@ -61,8 +70,6 @@ def render(pipeline, args):
     header_legend = " ".join(header_legend)
     args.outfile.write(header_legend)
 
-    col_width = {'m': 1, 'r': 8, 't': 17, 'p': 16 }
-
     col_pos = {}
     pos = args.width + 1
     for c in args.format:
@@ -87,9 +94,27 @@ def render(pipeline, args):
 
     print(header)
 
+
+def retires(i, stages):
+    if "end" in i and i["end"]:
+        return True
+    elif "RE" in stages:
+        return i["RE"] is not None
+    elif "C" in stages:
+        return i["C"] is not None
+    return False
+
+
+def decode_insn(i):
+    try:
+        return str(decode(int(i.insn), Variant("RV32IMZifencei_Zicsr")))
+    except:
+        return str(i.insn)
+
+
+def render_instructions(instructions, stages, args, model, count_retired=0):
     in_snip = False
-    count_retired = 0
-    for i in pipeline.log.values():
+    for i in instructions:
         if i.mode not in args.modes:
             if not in_snip:
                 args.outfile.write("~" * args.width + " snip (mode)\n")
@@ -112,6 +137,8 @@ def render(pipeline, args):
                             display[stage].back + "=" + \
                             colorama.Style.RESET_ALL
                     continue
+                if next >= len(stages):
+                    continue
                 next = stages[next]
                 if next in i and i[next] is not None:
                     for x in range(i[stage] + 1, i[next]):
@@ -130,14 +157,8 @@ def render(pipeline, args):
                 line += format(i.mode)
                 width = 1
             elif c == "r":
-                if "end" in i and i["end"]:
+                if retires(i, stages):
                     count_retired += 1
-                elif "RE" in stages:
-                    if i.RE is not None:
-                        count_retired += 1
-                elif "C" in stages:
-                    if i.C is not None:
-                        count_retired += 1
                 line += "{:8}".format(count_retired)
                 width = 8
             elif c == "t":
@@ -151,10 +172,7 @@ def render(pipeline, args):
                 line += "{:016x}".format(i.pc)
                 width = 16
             elif c == "i" and i.insn:
-                try:
-                    insn = str(decode(int(i.insn), Variant("RV32IMZifencei_Zicsr")))
-                except:
-                    insn = str(i.insn)
+                insn = decode_insn(i)
                 line += pygments.highlight(insn, pygments.lexers.GasLexer(), pygments.formatters.TerminalFormatter()).strip()
                 width = len(insn)
             elif c == "e":
@@ -192,6 +210,87 @@ def render(pipeline, args):
                     line += " "*(col_width[c] - width)
                 col += col_width[c]
         args.outfile.write(line+"\n")
+
+
+def format_delta(d, fmt="{:+}"):
+    return "-" if d is None else fmt.format(d)
+
+
+def record_fields(stages):
+    return ["pc", "insn", "mode"] + stages + ["end"]
+
+
+def instruction(record, stages):
+    return AttrDict(dict(zip(record_fields(stages), record)))
+
+
+def retired_counts(records, stages, args, starts):
+    # #retired before each start index, as rendering the whole trace counts it
+    starts = set(starts)
+    fields = record_fields(stages)
+    counts = {}
+    count_retired = 0
+    for x, r in enumerate(records):
+        if x in starts:
+            counts[x] = count_retired
+        if r[2] not in args.modes:
+            count_retired = 0
+        elif retires(dict(zip(fields, r)), stages):
+            count_retired += 1
+    return counts
+
+
+def render_diff(diff, args):
+    if args.colored:
+        colorama.init(strip=False)
+    else:
+        colorama.init()
+
+    stages = diff.stages
+    names = stages + ["total"]
+
+    hunks = diff.hunks(args.context, args.modes)
+    retired_a = retired_counts(diff.a, stages, args, [h[0] for h in hunks])
+    retired_b = retired_counts(diff.b, stages, args, [h[2] for h in hunks])
+
+    render_header(stages, args)
+    for a0, a1, b0, b1 in hunks:
+        args.outfile.write(colorama.Style.BRIGHT + colorama.Fore.CYAN +
+                           "@@ -{},{} +{},{} @@".format(a0, a1 - a0, b0, b1 - b0) +
+                           colorama.Style.RESET_ALL + "\n")
+        args.outfile.write(colorama.Fore.RED + "--- " + args.traceA +
+                           colorama.Style.RESET_ALL + "\n")
+        render_instructions([instruction(r, stages) for r in diff.a[a0:a1]], stages, args,
+                            None, retired_a[a0])
+        args.outfile.write(colorama.Fore.GREEN + "+++ " + args.traceB +
+                           colorama.Style.RESET_ALL + "\n")
+        render_instructions([instruction(r, stages) for r in diff.b[b0:b1]], stages, args,
+                            None, retired_b[b0])
+        changed = [x for x in range(a0, a1) if x in diff.deltas and diff.a[x][2] in args.modes]
+        if changed:
+            args.outfile.write(colorama.Style.BRIGHT + "latency delta (B - A) per -traceA +traceB index" +
+                               colorama.Style.RESET_ALL + "\n")
+        for x in changed:
+            y, delta = diff.deltas[x]
+            i = instruction(diff.a[x], stages)
+            line = "  -{} +{} {:016x} {}:".format(x, y, i.pc, decode_insn(i))
+            for s in range(len(names)):
+                if delta[s]:
+                    line += " {}:{}".format(names[s], format_delta(delta[s]))
+            args.outfile.write(line + "\n")
+
+    args.outfile.write("\n" + colorama.Style.BRIGHT +
+                       "mean latency delta per pc (cycles, B - A)" +
+                       colorama.Style.RESET_ALL + "\n")
+    line = "{:16} {:>8} {:>8}".format("pc", "count", "changed")
+    for n in names:
+        line += " {:>8}".format(n)
+    args.outfile.write(line + "\n")
+    for pc, stats in diff.top_pcs(args.top):
+        line = "{:016x} {:8} {:8}".format(pc, stats.count, stats.changed)
+        for s in range(len(names)):
+            line += " {:>8}".format(format_delta(stats.mean(s), "{:+.2f}"))
+        args.outfile.write(line + "\n")
     colorama.deinit()
 
 
@@ -204,7 +303,53 @@ def FileOrFolderType(f):
         raise Exception("Cannot find: {}".format(f))
 
 
+def TracePathType(f):
+    if f == "-" or os.path.exists(f):
+        return f
+    else:
+        raise Exception("Cannot find: {}".format(f))
+
+
+def main_diff(argv):
+    parser = argparse.ArgumentParser(prog="pipeline-viewer diff",
+                                     description="compare the pipeline traces of two runs of the same program")
+    parser.add_argument("core", choices=pipelines.keys())
+    parser.add_argument("traceA", help="baseline pipeline trace", type=TracePathType)
+    parser.add_argument("traceB", help="pipeline trace to compare", type=TracePathType)
+    parser.add_argument("outfile", nargs='?', help="file to render to", type=argparse.FileType('w'),
+                        default=sys.stdout)
+    parser.add_argument("-c", "--colored", action="store_true",
+                        help="force colored output")
+    parser.add_argument("-m", "--modes", default="MSU",
+                        help="only show from given modes")
+    parser.add_argument("-w", "--width", type=int,
+                        default=80, help="column width of graph")
+    parser.add_argument("-f", "--format", type=str, default="mrtpi")
+    parser.add_argument("-C", "--context", type=int, default=2,
+                        help="instructions shown around each difference")
+    parser.add_argument("-n", "--top", type=int, default=20,
+                        help="number of pcs in the latency summary")
+    args = parser.parse_args(argv)
+    args.modes = list(args.modes)
+    if "e" in args.format:
+        parser.error("format 'e' needs the full instruction stream and is not supported by diff")
+    if args.context < 0:
+        parser.error("context must not be negative")
+
+    if args.traceA == "-" and args.traceB == "-":
+        parser.error("only one trace can be read from stdin")
+
+    (a, stages_a), (b, stages_b) = parse_concurrently(pipelines[args.core], args.traceA, args.traceB)
+    if stages_a != stages_b:
+        parser.error("traces have different pipeline stages: {} vs. {}".format(
+            stages_a, stages_b))
+    render_diff(TraceDiff(a, b, stages_a), args)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "diff":
+        return main_diff(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument("core", choices=pipelines.keys())
     parser.add_argument("infile", nargs='?', help="file with pipeline trace", type=FileOrFolderType,
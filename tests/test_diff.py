@@ -0,0 +1,149 @@
+import io
+import random
+import sys
+import time
+
+from pipelineviewer.diff import align, parse_concurrently, TraceDiff
+
+
+def lcs_length(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b):
+            cur = row[j + 1]
+            row[j + 1] = prev + 1 if x == y else max(row[j + 1], row[j])
+            prev = cur
+    return row[-1]
+
+
+def check_opcodes(a, b, opcodes):
+    pa = pb = 0
+    equal = 0
+    for tag, a0, a1, b0, b1 in opcodes:
+        assert (a0, b0) == (pa, pb)
+        if tag == "equal":
+            assert a[a0:a1] == b[b0:b1]
+            equal += a1 - a0
+        elif tag == "insert":
+            assert a0 == a1 and b0 < b1
+        elif tag == "delete":
+            assert a0 < a1 and b0 == b1
+        pa, pb = a1, b1
+    assert (pa, pb) == (len(a), len(b))
+    return equal
+
+
+def check_align(a, b):
+    equal = check_opcodes(a, b, align(a, b))
+    # minimal edit script: everything not in a longest common subsequence
+    assert equal == lcs_length(a, b)
+
+
+def test_align_edge_cases():
+    for a, b in [([], []), ([1], []), ([], [1]), ([1], [1]), ([1], [2]),
+                 ([1, 2, 3], [1, 2, 3]), ([1, 2, 3], [3, 2, 1])]:
+        check_align(a, b)
+
+
+def test_align_random():
+    rnd = random.Random(26)
+    for _ in range(2000):
+        a = [rnd.randint(0, 3) for _ in range(rnd.randint(0, 25))]
+        b = [rnd.randint(0, 3) for _ in range(rnd.randint(0, 25))]
+        check_align(a, b)
+
+
+def test_align_long_similar():
+    rnd = random.Random(26)
+    a = [rnd.randint(0, 50) for _ in range(2000)]
+    b = list(a)
+    for _ in range(20):
+        b[rnd.randrange(len(b))] = 99
+    del b[100:110]
+    b[500:500] = [7] * 5
+    check_align(a, b)
+
+
+def test_align_diverging_is_bounded():
+    # Unrelated streams exceed the edit budget, the result is only checked
+    # to be consistent; this must not take quadratic time
+    rnd = random.Random(26)
+    a = [rnd.randint(0, 50) for _ in range(50000)]
+    b = [rnd.randint(0, 50) for _ in range(50000)]
+    start = time.time()
+    check_opcodes(a, b, align(a, b))
+    assert time.time() - start < 30
+
+
+def trace(n, stretch=None, mode="M"):
+    # records are (pc, insn, mode, IF, DE, end)
+    stretch = stretch or {}
+    return [(0x80000000 + 4 * (x % 4), str(x % 4), mode, x, x + 1, x + 2 + stretch.get(x, 0))
+            for x in range(n)]
+
+
+def test_latency_change():
+    d = TraceDiff(trace(20), trace(20, {7: 3, 8: 1}), ["IF", "DE"])
+    assert d.opcodes == [("equal", 0, 20, 0, 20)]
+    assert d.changed == [(7, 9, 7, 9)]
+    assert d.deltas == {7: (7, [0, 3, 3]), 8: (8, [0, 1, 1])}
+    assert d.hunks(2) == [(5, 11, 5, 11)]
+    pcs = d.top_pcs(10)
+    assert [pc for pc, _ in pcs] == [0x8000000c, 0x80000000]
+    assert pcs[0][1].changed == 1 and pcs[0][1].count == 5
+
+
+def test_latency_cancelling():
+    d = TraceDiff(trace(20), trace(20, {1: 2, 5: -2}), ["IF", "DE"])
+    pcs = d.top_pcs(10)
+    assert [pc for pc, _ in pcs] == [0x80000004]
+    assert pcs[0][1].mean(-1) == 0 and pcs[0][1].changed == 2
+
+
+def test_insert_delete():
+    a = trace(20)
+    b = trace(20)
+    del b[12]
+    b.insert(3, (0x90000000, "x", "M", 3, 4, 5))
+    d = TraceDiff(a, b, ["IF", "DE"])
+    assert d.changed == [(3, 3, 3, 4), (12, 13, 13, 13)]
+    assert d.deltas == {}
+    assert d.hunks(1) == [(2, 4, 2, 5), (11, 14, 12, 14)]
+    assert d.hunks(5) == [(0, 18, 0, 18)]
+
+
+def test_hunks_modes():
+    a = trace(10, mode="U") + trace(20)[10:]
+    b = trace(10, {3: 1}, "U") + trace(20, {12: 1})[10:]
+    d = TraceDiff(a, b, ["IF", "DE"])
+    assert d.hunks(1) == [(2, 5, 2, 5), (11, 14, 11, 14)]
+    assert d.hunks(1, ["M"]) == [(11, 14, 11, 14)]
+    assert d.hunks(1, ["U"]) == [(2, 5, 2, 5)]
+
+
+class LinePipeline(object):
+    # "pc insn IF" per line, enough to exercise the parse workers
+    def __init__(self, f):
+        self.log = {}
+        for n, line in enumerate(f):
+            pc, insn, t = line.split()
+            self.log[n] = {"pc": int(pc, 16), "insn": insn, "mode": "M", "IF": int(t)}
+
+    def get_stages(self):
+        return ["IF"]
+
+
+def test_parse_concurrently(tmp_path, monkeypatch):
+    a = tmp_path / "a.trace"
+    b = tmp_path / "b.trace"
+    a.write_text("80000000 nop 1\n80000004 ret 2\n")
+    b.write_text("80000000 nop 3\n")
+    assert parse_concurrently(LinePipeline, str(a), str(b)) == [
+        ([(0x80000000, "nop", "M", 1, None), (0x80000004, "ret", "M", 2, None)], ["IF"]),
+        ([(0x80000000, "nop", "M", 3, None)], ["IF"])]
+
+    monkeypatch.setattr(sys, "stdin", io.StringIO("80000008 j 5\n"))
+    assert parse_concurrently(LinePipeline, "-", str(b)) == [
+        ([(0x80000008, "j", "M", 5, None)], ["IF"]),
+        ([(0x80000000, "nop", "M", 3, None)], ["IF"])]
@@ -0,0 +1,94 @@
+import argparse
+import io
+
+import pytest
+
+pytest.importorskip("attrdict")
+pytest.importorskip("colorama")
+pytest.importorskip("riscvmodel")
+pytest.importorskip("babeltrace")
+
+from pipelineviewer import main
+from pipelineviewer.diff import TraceDiff
+
+STAGES = ["IF", "DE"]
+
+
+def trace(n, stretch=None, modes=None):
+    # records are (pc, insn, mode, IF, DE, end)
+    stretch = stretch or {}
+    modes = modes or {}
+    return [(0x80000000 + 4 * (x % 4), "nop", modes.get(x, "M"), 10 * x, 10 * x + 1,
+             None if x % 5 == 4 else 10 * x + 2 + stretch.get(x, 0))
+            for x in range(n)]
+
+
+def diff_args(**kwargs):
+    args = dict(outfile=io.StringIO(), colored=False, modes=["M"], width=20,
+                format="rp", context=1, top=5, traceA="a.trace", traceB="b.trace")
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_retired_counts_match_full_render():
+    records = trace(30, modes={x: "U" for x in (8, 9, 10, 21)})
+    args = diff_args()
+    main.render_instructions([main.instruction(r, STAGES) for r in records], STAGES, args, None)
+    full = args.outfile.getvalue().splitlines()
+
+    starts = [x for x in range(len(records)) if records[x][2] in args.modes]
+    counts = main.retired_counts(records, STAGES, args, starts)
+    for x in starts:
+        args.outfile = io.StringIO()
+        main.render_instructions([main.instruction(r, STAGES) for r in records[x:]], STAGES, args,
+                                 None, counts[x])
+        part = args.outfile.getvalue().splitlines()
+        assert part == full[len(full) - len(part):]
+
+
+def test_render_diff():
+    a = trace(20)
+    b = trace(20, {7: 3})
+    del b[15]
+    args = diff_args()
+    main.render_diff(TraceDiff(a, b, STAGES), args)
+    out = args.outfile.getvalue()
+
+    assert "@@ -6,3 +6,3 @@" in out
+    assert "@@ -14,3 +14,2 @@" in out
+    # retired numbers continue from the start of the trace, every fifth
+    # instruction does not retire
+    for x, retired in [(6, 6), (7, 7), (8, 8), (14, 12), (15, 13), (16, 14)]:
+        assert "{:8} {:016x}".format(retired, a[x][0]) in out
+    assert "-7 +7 {:016x} nop: DE:+3 total:+3".format(a[7][0]) in out
+    # the deleted instance is not counted, the unretired one has no DE delta
+    assert "{:016x}        4        1    +0.00    +1.00    +0.75".format(a[7][0]) in out
+
+
+def test_render_diff_modes():
+    a = trace(20, modes={x: "U" for x in range(10)})
+    b = trace(20, {3: 1}, modes={x: "U" for x in range(10)})
+    args = diff_args()
+    main.render_diff(TraceDiff(a, b, STAGES), args)
+    assert "@@" not in args.outfile.getvalue()
+
+
+@pytest.mark.parametrize("argv", [
+    ["-", "-"],
+    ["-", "{trace}", "-f", "rpe"],
+    ["-", "{trace}", "-C", "-1"],
+])
+def test_main_diff_rejects(argv, tmp_path):
+    trace = tmp_path / "b.trace"
+    trace.write_text("")
+    with pytest.raises(SystemExit):
+        main.main_diff(["boom"] + [a.format(trace=trace) for a in argv])
+
+
+def test_main_diff_stage_mismatch(tmp_path, monkeypatch):
+    trace = tmp_path / "b.trace"
+    trace.write_text("")
+    monkeypatch.setattr(main, "parse_concurrently",
+                        lambda cls, a, b: [([], ["IF", "IDEX"]), ([], ["IF", "IDEX", "WB"])])
+    with pytest.raises(SystemExit):
+        main.main_diff(["ibex", str(trace), str(trace)])